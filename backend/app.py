@@ -1,55 +1,440 @@
 from __future__ import annotations
 
+import atexit
+import base64
 import hashlib
+import hmac
 import json
+import mimetypes
+import os
+import queue
+import re
 import secrets
+import socket
 import sqlite3
 import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Callable, Dict, Optional
-
-from flask import Flask, abort, jsonify, make_response, request, send_from_directory
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    has_request_context,
+    jsonify,
+    make_response,
+    request,
+    send_file,
+)
+from flask.json.provider import DefaultJSONProvider
 from flask_sock import Sock
+from werkzeug.http import dump_cookie
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 未安装 orjson 时回退到标准库
+    orjson = None
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:  # pragma: no cover - 未安装 argon2-cffi 时回退到 scrypt
+    PasswordHasher = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - 未安装 msgspec 时仅提供 JSON
+    msgspec = None
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 FRONTEND_DIR = BASE_DIR
 DATABASE_PATH = Path(__file__).resolve().parent / "wellness.db"
+SQLITE_CACHED_STATEMENTS = 256
+SQLITE_POOL_SIZE = 8
+SQLITE_CACHE_SIZE_KIB = 64 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
 SESSION_COOKIE_NAME = "session_token"
+HASHED_ASSET_PATTERN = re.compile(r"\.[0-9a-f]{8,}\.(?:css|js|png|jpe?g|svg|webp|woff2?)$")
+STATIC_CACHE_SUFFIXES = frozenset({
+    ".html", ".css", ".js", ".json", ".svg", ".png", ".jpg", ".jpeg",
+    ".gif", ".webp", ".ico", ".woff", ".woff2", ".txt",
+})
+STATIC_CACHE_MAX_FILE_BYTES = 512 * 1024
+# 前端目录即仓库根目录，只对外提供根目录下的页面和这些资源目录中的前端文件，
+# 后端代码、数据库、日志、脚本和文档都不在其中
+FRONTEND_ASSET_DIRS = frozenset({"assets", "css", "js", "public", "src"})
+FRONTEND_ROOT_SUFFIXES = frozenset({".html"})
 SESSION_MAX_AGE = 60 * 60 * 24 * 30  # 30 days
 ONLINE_THRESHOLD_SECONDS = 60
-ONLINE_BROADCAST_INTERVAL = 10
+PASSWORD_ARGON2_PREFIX = "$argon2"
+PASSWORD_SCRYPT_PREFIX = "scrypt"
+PASSWORD_SCRYPT_N = 2 ** 14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_SCRYPT_DKLEN = 32
+PASSWORD_SALT_BYTES = 16
+ONLINE_NOTIFY_DEBOUNCE = 0.2
+ONLINE_NOTIFY_RETRY_DELAY = 1
+LAST_SEEN_FLUSH_INTERVAL = 3
+SESSION_PRUNE_INTERVAL = 5 * 60
+SESSION_CACHE_TTL = 5
+SESSION_CACHE_MAX_SIZE = 10_000
+ONLINE_USERS_CACHE_TTL = 5
+CHAT_HISTORY_LIMIT = 50
+CHAT_MAX_INBOUND_MESSAGE_SIZE = 4096
+WS_FORMAT_JSON = "json"
+WS_FORMAT_MSGPACK = "msgpack"
+MSGPACK_ENCODER = msgspec.msgpack.Encoder() if msgspec is not None else None
+# orjson 3.9 起提供 Fragment，可把已编码的 JSON 原样嵌入输出
+JSON_FRAGMENT = getattr(orjson, "Fragment", None)
+password_hasher = PasswordHasher() if PasswordHasher is not None else None
+
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def loads_json(data: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+PONG_MESSAGE = dumps_json({"type": "pong"})
+PING_MESSAGES = frozenset({"ping", '"ping"'})
+# 会话失效时的响应体和清除 Cookie 的响应头只需生成一次
+INVALID_SESSION_BODY = dumps_json({"error": "会话无效"}).encode("utf-8")
+INVALID_SESSION_HEADERS = [
+    ("Content-Type", "application/json"),
+    (
+        "Set-Cookie",
+        dump_cookie(
+            SESSION_COOKIE_NAME,
+            "",
+            max_age=0,
+            secure=False,
+            httponly=True,
+            samesite="Lax",
+            path="/",
+        ),
+    ),
+]
+
+
+class OrjsonJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        option = self._orjson_option(
+            kwargs.get("sort_keys", self.sort_keys), bool(kwargs.get("indent"))
+        )
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        # jsonify 直接使用 orjson 输出的 bytes 作为响应体，省去先解码成 str 再编码回去的开销
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        option = self._orjson_option(self.sort_keys, indent) | orjson.OPT_APPEND_NEWLINE
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype
+        )
+
+    @staticmethod
+    def _orjson_option(sort_keys: bool, indent: bool) -> int:
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    @staticmethod
+    def default(o: Any) -> Any:
+        # 查询结果行可以直接交给编码器，列名在 SQL 中已按接口字段命名
+        if isinstance(o, sqlite3.Row):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def now_iso() -> str:
+    # 所有写入共用这一个时钟（UTC、微秒精度，排行榜按 updated_at 区分先后）。
+    # 同一个 HTTP 请求内写入的各行共用一个时间戳，例如注册时的账号与会话、成绩与活动记录；
+    # WebSocket 连接的请求上下文会持续整个连接，其中的每条消息和后台线程都取实时时间
+    if not has_request_context() or is_websocket_request():
+        return datetime.now(timezone.utc).isoformat()
+    timestamp = g.get("now_iso")
+    if timestamp is None:
+        timestamp = g.now_iso = datetime.now(timezone.utc).isoformat()
+    return timestamp
+
+
+def is_websocket_request() -> bool:
+    return request.environ.get("HTTP_UPGRADE", "").lower() == "websocket"
+
+
+def resolve_ws_format(requested: Optional[str]) -> str:
+    if requested == WS_FORMAT_MSGPACK and MSGPACK_ENCODER is not None:
+        return WS_FORMAT_MSGPACK
+    return WS_FORMAT_JSON
+
+
+def is_ping(message: str | bytes) -> bool:
+    # 客户端心跳几乎都是原样的 "ping"，先做一次集合查找，其余写法再规范化后比较
+    if message in PING_MESSAGES:
+        return True
+    return isinstance(message, str) and message.strip().lower() == "ping"
+
+
+def encode_ws_payload(payload: Dict[str, Any], fmt: str = WS_FORMAT_JSON) -> str | bytes:
+    if fmt == WS_FORMAT_MSGPACK:
+        return MSGPACK_ENCODER.encode(payload)
+    return dumps_json(payload)
+
+
+class SubmissionDecoder:
+    def __init__(self, name: str, fields: tuple[tuple[str, type], ...]) -> None:
+        self._fields = fields
+        self._decoder = None
+        if msgspec is not None:
+            # 解析 JSON 与字段类型转换一次完成；strict=False 时与 int() 一样接受 "123" 这类字符串
+            struct_type = msgspec.defstruct(name, list(fields))
+            self._decoder = msgspec.json.Decoder(struct_type, strict=False)
+
+    def decode_request(self, req: Any) -> Optional[tuple[Any, ...]]:
+        # 与 request.get_json 一致，只接受 Content-Type 为 JSON 的请求体
+        if not req.is_json:
+            return None
+        return self.decode(req.get_data())
+
+    def decode(self, data: bytes) -> Optional[tuple[Any, ...]]:
+        if self._decoder is not None:
+            try:
+                return msgspec.structs.astuple(self._decoder.decode(data))
+            except msgspec.DecodeError:
+                return None
+
+        try:
+            payload = loads_json(data)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict):
+            return None
+
+        values: list[Any] = []
+        for name, field_type in self._fields:
+            value = payload.get(name)
+            if field_type is int:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    return None
+            elif not isinstance(value, field_type):
+                return None
+            values.append(value)
+        return tuple(values)
+
+
+SCHULTE_SUBMISSION = SubmissionDecoder(
+    "SchulteSubmission", (("gridSize", int), ("elapsedMs", int))
+)
+REACTION_SUBMISSION = SubmissionDecoder("ReactionSubmission", (("reactionTimeMs", int),))
+MEMORY_FLIP_SUBMISSION = SubmissionDecoder(
+    "MemoryFlipSubmission", (("elapsedMs", int), ("moves", int))
+)
+SUDOKU_SUBMISSION = SubmissionDecoder(
+    "SudokuSubmission", (("difficulty", str), ("elapsedMs", int), ("mistakes", int))
+)
+
+
+WS_SEND_WORKERS = 16
+WS_SEND_TIMEOUT = 2.0
+WS_SEND_BATCH_SIZE = 50
+ws_send_pool = ThreadPoolExecutor(max_workers=WS_SEND_WORKERS, thread_name_prefix="ws-send")
+
+
+_ws_send_locks: weakref.WeakKeyDictionary[Any, threading.Lock] = weakref.WeakKeyDictionary()
+_ws_send_locks_guard = threading.Lock()
+
+
+def ws_send_lock(ws: Any) -> threading.Lock:
+    with _ws_send_locks_guard:
+        lock = _ws_send_locks.get(ws)
+        if lock is None:
+            lock = _ws_send_locks[ws] = threading.Lock()
+    return lock
+
+
+def send_ws(ws: Any, payload: str | bytes) -> None:
+    # 应用层的写入（广播、历史、快照、pong）在同一连接上串行执行，不会交错写出半个帧；
+    # 帧的编码和写出都交给 simple_websocket，卡住的写入由广播超时后关闭连接来打断
+    with ws_send_lock(ws):
+        ws.send(payload)
+
+
+def close_ws(ws: Any) -> None:
+    # 对端不再读取时关闭帧也写不出去，直接关闭底层连接：
+    # 阻塞中的写入立即失败，接收线程醒来后处理函数退出，客户端可以重连
+    if not getattr(ws, "connected", True):
+        return
+    sock = getattr(ws, "sock", None)
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+        else:
+            ws.close()
+    except Exception:
+        pass
+
+
+def _timed_send(started: dict[Any, float], ws: Any, payload: str | bytes) -> None:
+    # 超时从真正开始发送时算起，在线程池里排队的时间不计入
+    started[ws] = time.monotonic()
+    send_ws(ws, payload)
+
+
+def _wait_for_sends(futures: dict[Future, Any], started: dict[Any, float]) -> list[Any]:
+    failed: list[Any] = []
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        expired = [
+            future
+            for future in pending
+            if futures[future] in started
+            and now - started[futures[future]] >= WS_SEND_TIMEOUT
+        ]
+        for future in expired:
+            future.cancel()
+            failed.append(futures[future])
+        pending.difference_update(expired)
+        if not pending:
+            break
+
+        deadlines = [
+            started[futures[future]] + WS_SEND_TIMEOUT
+            for future in pending
+            if futures[future] in started
+        ]
+        # 排队中的任务开始时不会通知这里，至少每个超时周期检查一次
+        timeout = min(deadlines) - now if deadlines else WS_SEND_TIMEOUT
+        done, pending = wait(pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+        failed.extend(futures[future] for future in done if future.exception() is not None)
+    return failed
+
+
+def send_to_clients(sends: list[tuple[Any, str | bytes]]) -> list[Any]:
+    # 并行发送，避免单个慢客户端拖住后面所有订阅者；返回已断开、发送失败或超时的连接，由调用方关闭
+    stale: list[Any] = []
+    open_sends: list[tuple[Any, str | bytes]] = []
+    for ws, payload in sends:
+        # simple_websocket 的连接关闭后 connected 为 False，无需再尝试发送
+        if getattr(ws, "connected", True):
+            open_sends.append((ws, payload))
+        else:
+            stale.append(ws)
+    sends = open_sends
+
+    # 单个客户端也走线程池，卡住的写入同样受超时约束，不会拖住调用方
+    for start in range(0, len(sends), WS_SEND_BATCH_SIZE):
+        if start:
+            # 大规模广播分批进行，批次之间让出 GIL，避免饿死其他线程
+            time.sleep(0)
+        batch = sends[start:start + WS_SEND_BATCH_SIZE]
+        started: dict[Any, float] = {}
+        futures: dict[Future, Any] = {}
+        for ws, payload in batch:
+            futures[ws_send_pool.submit(_timed_send, started, ws, payload)] = ws
+        stale.extend(_wait_for_sends(futures, started))
+    return stale
 
 
 class ChatManager:
     def __init__(self) -> None:
-        self._clients: dict[Any, str] = {}
+        self._clients: dict[Any, tuple[str, str]] = {}
+        # 只在客户端增减时重建的只读快照，广播时无需加锁复制
+        self._clients_snapshot: tuple[tuple[Any, str], ...] = ()
         self._lock = threading.Lock()
-
-    def register(self, ws: Any, username: str) -> None:
+        self._last_user_list: Optional[str] = None
+        self._last_user_list_message: Optional[Dict[str, Any]] = None
+        # 最近的聊天记录保存在内存中，新用户加入时不必每次查库
+        self._history: Optional[deque[Dict[str, Any]]] = None
+        self._history_latest_id: Optional[int] = None
+        self._history_payloads: dict[str, str | bytes] = {}
+
+    def register(self, ws: Any, username: str, fmt: str = WS_FORMAT_JSON) -> None:
         with self._lock:
-            self._clients[ws] = username
-        self.broadcast_user_list()
-        self._send_history(ws)
+            self._clients[ws] = (username, fmt)
+            self._refresh_snapshot_locked()
+        if not self.broadcast_user_list():
+            # 在线列表没有变化时不再全员广播，但新加入的客户端仍需要一份
+            self._send(ws, self._last_user_list_message, fmt)
+        self._send_history(ws, fmt)
         self.broadcast_system_message(f"用户 {username} 加入了聊天室")
 
     def unregister(self, ws: Any) -> None:
-        username = None
+        self._drop_clients([ws])
+
+    def _drop_clients(self, clients: list[Any]) -> None:
+        usernames: list[str] = []
         with self._lock:
-            if ws in self._clients:
-                username = self._clients.pop(ws)
-        if username:
+            for ws in clients:
+                entry = self._clients.pop(ws, None)
+                if entry is not None:
+                    usernames.append(entry[0])
+            if usernames:
+                self._refresh_snapshot_locked()
+        # 失效的连接要真正关闭，否则处理函数仍在运行，用户留在房间里却再也收不到消息
+        for ws in clients:
+            close_ws(ws)
+        if usernames:
             self.broadcast_user_list()
-            self.broadcast_system_message(f"用户 {username} 离开了聊天室")
-
-    def broadcast_user_list(self) -> None:
-        # 获取所有在线用户，包括不在聊天室的用户
-        online_users = list_online_users()
-        self.broadcast({
+            for username in usernames:
+                self.broadcast_system_message(f"用户 {username} 离开了聊天室")
+
+    def broadcast_user_list(self) -> bool:
+        # 最后一个客户端离开后不再查询和编码列表；下一个客户端注册时会重新比较
+        if not self._clients_snapshot:
+            return False
+        # 获取所有在线用户，包括不在聊天室的用户；会话变化时缓存会失效，
+        # 进出聊天室本身不改变列表，直接复用缓存的结果
+        online_users = online_users_cache.get()
+        message = {
             "type": "user_list",
             "payload": {"users": online_users},
-        })
+        }
+        payload = self._serialize(message)
+        with self._lock:
+            if payload == self._last_user_list:
+                return False
+            self._last_user_list = payload
+            self._last_user_list_message = message
+        self._broadcast_payload(message, payload)
+        return True
 
     def broadcast_message(self, message: Dict[str, Any]) -> None:
+        with self._lock:
+            # 重新加载历史时可能已包含这条消息，只追加更新的消息
+            if self._history is not None and (
+                self._history_latest_id is None or message["id"] > self._history_latest_id
+            ):
+                self._history.append(message)
+                self._history_latest_id = message["id"]
+                self._history_payloads = {}
         self.broadcast({
             "type": "chat_message",
             "payload": message,
@@ -58,140 +443,417 @@ class ChatManager:
     def broadcast_system_message(self, text: str) -> None:
         message = {
             "text": text,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now_iso(),
         }
         self.broadcast({
             "type": "system_message",
             "payload": message,
         })
 
-    def broadcast(self, data: Dict[str, Any]) -> None:
+    def send_system_message(self, ws: Any, text: str) -> None:
+        # 只发给指定的客户端，例如提示消息被拒绝
         with self._lock:
-            clients = list(self._clients.keys())
+            entry = self._clients.get(ws)
+        if entry is None:
+            return
+        message = {
+            "type": "system_message",
+            "payload": {"text": text, "timestamp": now_iso()},
+        }
+        self._send(ws, message, entry[1])
+
+    def broadcast(self, data: Dict[str, Any]) -> None:
+        if not self._clients_snapshot:
+            return
+        self._broadcast_payload(data)
+
+    def _broadcast_payload(
+        self, message: Dict[str, Any], json_payload: Optional[str] = None
+    ) -> None:
+        clients = self._clients_snapshot
         if not clients:
             return
 
-        payload = self._serialize(data)
-        stale: list[Any] = []
+        # 每种格式只编码一次，所有同格式的客户端共用同一份数据
+        payloads: dict[str, str | bytes] = {}
+        if json_payload is not None:
+            payloads[WS_FORMAT_JSON] = json_payload
+        sends: list[tuple[Any, str | bytes]] = []
+        for ws, fmt in clients:
+            payload = payloads.get(fmt)
+            if payload is None:
+                payload = payloads[fmt] = self._serialize(message, fmt)
+            sends.append((ws, payload))
 
-        for ws in clients:
-            try:
-                ws.send(payload)
-            except Exception:
-                stale.append(ws)
+        stale = send_to_clients(sends)
 
         if stale:
-            with self._lock:
-                for ws in stale:
-                    self._clients.pop(ws, None)
+            self._drop_clients(stale)
+
+    def _refresh_snapshot_locked(self) -> None:
+        self._clients_snapshot = tuple(
+            (ws, fmt) for ws, (_, fmt) in self._clients.items()
+        )
+
+    def _send(self, ws: Any, message: Optional[Dict[str, Any]], fmt: str) -> None:
+        if message is None:
+            return
+        try:
+            send_ws(ws, self._serialize(message, fmt))
+        except Exception:
+            self.unregister(ws)
 
-    def _send_history(self, ws: Any) -> None:
+    def _send_history(self, ws: Any, fmt: str) -> None:
         try:
-            history = [serialize_chat_message(msg) for msg in list_chat_messages()]
-            ws.send(self._serialize({
-                "type": "chat_history",
-                "payload": history,
-            }))
+            send_ws(ws, self._history_snapshot(fmt))
         except Exception:
             self.unregister(ws)
 
+    def _history_snapshot(self, fmt: str = WS_FORMAT_JSON) -> str | bytes:
+        # 多个 worker 进程共用数据库，最新消息 id 不一致时说明有其他进程写入，需要重新加载
+        latest_id = latest_chat_message_id()
+        with self._lock:
+            if self._history is not None and self._history_latest_id == latest_id:
+                payload = self._history_payloads.get(fmt)
+                if payload is None:
+                    payload = self._history_payloads[fmt] = self._serialize({
+                        "type": "chat_history",
+                        "payload": list(self._history),
+                    }, fmt)
+                return payload
+
+        history = [
+            serialize_chat_message(msg) for msg in list_chat_messages(CHAT_HISTORY_LIMIT)
+        ]
+        payload = self._serialize({
+            "type": "chat_history",
+            "payload": history,
+        }, fmt)
+        with self._lock:
+            self._history = deque(history, maxlen=CHAT_HISTORY_LIMIT)
+            self._history_latest_id = history[-1]["id"] if history else None
+            self._history_payloads = {fmt: payload}
+        return payload
+
     @staticmethod
-    def _serialize(payload: Dict[str, Any]) -> str:
-        return json.dumps(payload, ensure_ascii=False)
+    def _serialize(payload: Dict[str, Any], fmt: str = WS_FORMAT_JSON) -> str | bytes:
+        return encode_ws_payload(payload, fmt)
 
 
 class OnlineUserNotifier:
-    def __init__(self, fetch_users: Callable[[], list[Dict[str, Any]]], interval: int = ONLINE_BROADCAST_INTERVAL) -> None:
+    def __init__(
+        self,
+        fetch_users: Callable[[], list[Dict[str, Any]]],
+        prune_sessions: Optional[Callable[[], int]] = None,
+    ) -> None:
         self._fetch_users = fetch_users
-        self._interval = interval
-        self._clients: set[Any] = set()
+        self._prune_sessions = prune_sessions
+        self._clients: dict[Any, str] = {}
+        self._clients_snapshot: tuple[tuple[Any, str], ...] = ()
         self._lock = threading.Lock()
+        self._last_payload: Optional[str] = None
+        self._offline_deadline: Optional[float] = None
         self._stop = threading.Event()
-        self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._dirty = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._notify_loop, daemon=True)
         self._thread.start()
 
-    def _poll_loop(self) -> None:
-        while not self._stop.wait(self._interval):
-            self.broadcast_current()
-
-    def register(self, ws: Any) -> None:
+    def _notify_loop(self) -> None:
+        # 只在会话变化、有在线用户即将超时或需要清理过期会话时醒来，没有固定的轮询周期
+        next_prune = time.monotonic() + SESSION_PRUNE_INTERVAL
+        while not self._stop.is_set():
+            with self._lock:
+                deadline = self._offline_deadline
+            wake_at = next_prune if deadline is None else min(next_prune, deadline)
+            self._wake.wait(max(wake_at - time.monotonic(), 0))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            now = time.monotonic()
+            if self._prune_sessions is not None and now >= next_prune:
+                next_prune = now + SESSION_PRUNE_INTERVAL
+                try:
+                    self._prune_sessions()
+                except sqlite3.Error:
+                    pass
+
+            expired = deadline is not None and now >= deadline
+            if not self._dirty.is_set() and not expired:
+                continue
+            # 短暂等待以合并连续的会话变更，一批变更只广播一次
+            if self._dirty.is_set():
+                self._stop.wait(ONLINE_NOTIFY_DEBOUNCE)
+            self._dirty.clear()
+            try:
+                self.broadcast_current()
+            except (sqlite3.Error, ValueError):
+                # 查询失败（例如数据库暂时被锁）时线程不能退出，稍后重试这一轮推送
+                self._dirty.set()
+                self._stop.wait(ONLINE_NOTIFY_RETRY_DELAY)
+                self._wake.set()
+
+    def register(self, ws: Any, fmt: str = WS_FORMAT_JSON) -> None:
         with self._lock:
-            self._clients.add(ws)
-        self._send_snapshot(ws)
+            self._clients[ws] = fmt
+            self._clients_snapshot = tuple(self._clients.items())
+        self._send_snapshot(ws, fmt)
 
     def unregister(self, ws: Any) -> None:
         with self._lock:
-            self._clients.discard(ws)
+            self._clients.pop(ws, None)
+            self._clients_snapshot = tuple(self._clients.items())
+        close_ws(ws)
 
     def shutdown(self) -> None:
         self._stop.set()
-        self.broadcast([])
+        self._wake.set()
+        self.broadcast([], force=True)
 
     def broadcast_current(self) -> None:
-        self.broadcast(self._fetch_users())
+        if not self._clients_snapshot:
+            with self._lock:
+                self._offline_deadline = None
+            return
+        users = self._fetch_users()
+        self._schedule_offline_check(users)
+        self.broadcast(users)
 
-    def broadcast(self, users: list[Dict[str, Any]]) -> None:
+    def broadcast(self, users: list[Dict[str, Any]], force: bool = False) -> None:
+        message = {"type": "online_users", "users": users}
+        json_payload = self._serialize(message)
         with self._lock:
-            clients = list(self._clients)
+            # 列表与上次广播完全一致时跳过，新客户端注册时会单独收到快照
+            if not force and json_payload == self._last_payload:
+                return
+            self._last_payload = json_payload
+        clients = self._clients_snapshot
         if not clients:
             return
 
-        payload = self._serialize({"type": "online_users", "users": users})
-        stale: list[Any] = []
+        # 每种格式只编码一次，所有同格式的客户端共用同一份数据
+        payloads: dict[str, str | bytes] = {WS_FORMAT_JSON: json_payload}
+        sends: list[tuple[Any, str | bytes]] = []
 
-        for ws in clients:
-            try:
-                ws.send(payload)
-            except Exception:
-                stale.append(ws)
+        for ws, fmt in clients:
+            payload = payloads.get(fmt)
+            if payload is None:
+                payload = payloads[fmt] = self._serialize(message, fmt)
+            sends.append((ws, payload))
+
+        stale = send_to_clients(sends)
 
         if stale:
             with self._lock:
                 for ws in stale:
-                    self._clients.discard(ws)
+                    self._clients.pop(ws, None)
+                self._clients_snapshot = tuple(self._clients.items())
+            for ws in stale:
+                close_ws(ws)
 
     def notify(self) -> None:
-        self.broadcast_current()
-
-    def _send_snapshot(self, ws: Any) -> None:
+        self._dirty.set()
+        self._wake.set()
+
+    def _schedule_offline_check(self, users: list[Dict[str, Any]]) -> None:
+        # 记录最早会因心跳超时而变为离线的时间点，到点时再推送一次列表
+        expiries: list[float] = []
+        for user in users:
+            if not user["online"] or not user["lastSeen"]:
+                continue
+            try:
+                last_seen = datetime.fromisoformat(user["lastSeen"])
+            except ValueError:
+                continue
+            if last_seen.tzinfo is None:
+                last_seen = last_seen.replace(tzinfo=timezone.utc)
+            expiries.append(last_seen.timestamp())
+        deadline = None
+        if expiries:
+            # 多等 1 秒，保证查询时该用户已越过在线阈值
+            delay = min(expiries) + ONLINE_THRESHOLD_SECONDS + 1 - time.time()
+            deadline = time.monotonic() + max(delay, 0)
+        with self._lock:
+            changed = deadline != self._offline_deadline
+            self._offline_deadline = deadline
+        if changed:
+            self._wake.set()
+
+    def _send_snapshot(self, ws: Any, fmt: str) -> None:
+        users = self._fetch_users()
+        self._schedule_offline_check(users)
         try:
-            ws.send(
+            send_ws(
+                ws,
                 self._serialize(
                     {
                         "type": "online_users",
-                        "users": self._fetch_users(),
-                    }
-                )
+                        "users": users,
+                    },
+                    fmt,
+                ),
             )
         except Exception:
             self.unregister(ws)
 
     @staticmethod
-    def _serialize(payload: Dict[str, Any]) -> str:
-        return json.dumps(payload, ensure_ascii=False)
+    def _serialize(payload: Dict[str, Any], fmt: str = WS_FORMAT_JSON) -> str | bytes:
+        return encode_ws_payload(payload, fmt)
+
+
+class LastSeenBuffer:
+    def __init__(self, interval: float = LAST_SEEN_FLUSH_INTERVAL) -> None:
+        self._interval = interval
+        self._pending: dict[str, tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                continue
+
+    def touch(self, token: str, account_id: int, timestamp: str) -> None:
+        with self._lock:
+            self._pending[token] = (account_id, timestamp)
+
+    def contains(self, token: str) -> bool:
+        with self._lock:
+            return token in self._pending
+
+    def account_id_for(self, token: str) -> Optional[int]:
+        with self._lock:
+            entry = self._pending.get(token)
+        return entry[0] if entry else None
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._pending.pop(token, None)
+
+    def latest_by_account(self) -> dict[int, str]:
+        latest: dict[int, str] = {}
+        with self._lock:
+            for account_id, timestamp in self._pending.values():
+                if timestamp > latest.get(account_id, ""):
+                    latest[account_id] = timestamp
+        return latest
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with get_db_connection() as connection:
+            connection.executemany(
+                "UPDATE sessions SET last_seen = ? WHERE token = ?",
+                [(timestamp, token) for token, (_, timestamp) in pending.items()],
+            )
+        # 每批心跳落库后只通知一次在线状态变化，而不是每次心跳都通知
+        notify_online_users_change()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self.flush()
+
+
+class SessionAccountCache:
+    def __init__(self, ttl: float = SESSION_CACHE_TTL, max_size: int = SESSION_CACHE_MAX_SIZE) -> None:
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: dict[str, tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, account = entry
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                return None
+            return account
+
+    def put(self, token: str, account: Dict[str, Any]) -> None:
+        with self._lock:
+            if token not in self._entries and len(self._entries) >= self._max_size:
+                # dict 保持插入顺序，满了就淘汰最早写入的条目
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[token] = (time.monotonic() + self._ttl, account)
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(token, None)
+
+
+class OnlineUsersCache:
+    def __init__(self, ttl: float = ONLINE_USERS_CACHE_TTL) -> None:
+        self._ttl = ttl
+        self._entry: Optional[tuple[float, list[Dict[str, Any]]]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> list[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entry
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return self.refresh()
+
+    def refresh(self) -> list[Dict[str, Any]]:
+        with self._lock:
+            generation = self._generation
+        users = list_online_users()
+        with self._lock:
+            # 查询期间会话发生过变化时不写回，避免把旧列表缓存下来
+            if generation == self._generation:
+                self._entry = (time.monotonic() + self._ttl, users)
+        return users
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entry = None
 
 
 online_user_notifier: Optional[OnlineUserNotifier] = None
+last_seen_buffer: Optional[LastSeenBuffer] = None
+session_account_cache = SessionAccountCache()
+online_users_cache = OnlineUsersCache()
 chat_manager = ChatManager()
 
 
 def notify_online_users_change() -> None:
+    online_users_cache.invalidate()
     if online_user_notifier is not None:
         online_user_notifier.notify()
 
 
 def create_app() -> Flask:
     app = Flask(__name__)
+    app.json = OrjsonJSONProvider(app)
     app.config["JSON_AS_ASCII"] = False
     app.config["DATABASE"] = DATABASE_PATH
 
     sock = Sock(app)
 
     init_db(app.config["DATABASE"])
+    frontend_index()
 
-    global online_user_notifier
+    global online_user_notifier, last_seen_buffer
+    if last_seen_buffer is None:
+        last_seen_buffer = LastSeenBuffer()
+        atexit.register(last_seen_buffer.shutdown)
     if online_user_notifier is None:
-        online_user_notifier = OnlineUserNotifier(list_online_users)
+        # 推送线程总是重新查询并顺带刷新缓存，到点下线的检查不会读到过期的在线状态
+        online_user_notifier = OnlineUserNotifier(
+            online_users_cache.refresh, prune_sessions=delete_expired_sessions
+        )
 
     @app.get("/api/healthz")
     def healthcheck() -> Any:
@@ -205,17 +867,7 @@ def create_app() -> Flask:
 
         account = fetch_account_by_session_token(token)
         if not account:
-            response = jsonify({"error": "会话无效"})
-            response.set_cookie(
-                SESSION_COOKIE_NAME,
-                "",
-                max_age=0,
-                secure=False,
-                httponly=True,
-                samesite="Lax",
-                path="/",
-            )
-            return response, 401
+            return INVALID_SESSION_BODY, 401, INVALID_SESSION_HEADERS
 
         update_session_last_seen(token)
         return jsonify({"user": serialize_account(account)})
@@ -227,17 +879,7 @@ def create_app() -> Flask:
             return jsonify({"error": "未登录"}), 401
 
         if not update_session_last_seen(token):
-            response = jsonify({"error": "会话无效"})
-            response.set_cookie(
-                SESSION_COOKIE_NAME,
-                "",
-                max_age=0,
-                secure=False,
-                httponly=True,
-                samesite="Lax",
-                path="/",
-            )
-            return response, 401
+            return INVALID_SESSION_BODY, 401, INVALID_SESSION_HEADERS
 
         return ("", 204)
 
@@ -292,6 +934,12 @@ def create_app() -> Flask:
         if not account or not verify_password(password, account["password_hash"]):
             return jsonify({"error": "用户名或密码不正确。"}), 401
 
+        if password_needs_rehash(account["password_hash"]):
+            try:
+                update_account_password_hash(account["id"], hash_password(password))
+            except sqlite3.Error:
+                pass
+
         token = create_session(account_id=account["id"])
         response = make_response(jsonify({"user": serialize_account(account)}))
         response.set_cookie(
@@ -326,7 +974,7 @@ def create_app() -> Flask:
 
     @app.get("/api/online-users")
     def online_users() -> Any:
-        users = list_online_users()
+        users = online_users_cache.get()
         return jsonify({"users": users})
 
     @app.post("/api/activity")
@@ -394,9 +1042,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取个人成绩失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [serialize_schulte_record(item) for item in records]
-        })
+        return jsonify({"records": records})
 
     @app.get("/api/schulte/leaderboard")
     def schulte_leaderboard() -> Any:
@@ -405,9 +1051,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取排行榜失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [serialize_schulte_record(item, include_username=True) for item in records]
-        })
+        return jsonify({"records": records})
 
     @app.post("/api/schulte/records")
     def submit_schulte_record() -> Any:
@@ -415,15 +1059,10 @@ def create_app() -> Flask:
         if not account:
             return jsonify({"error": "未登录"}), 401
 
-        payload = request.get_json(silent=True) or {}
-        grid_size = payload.get("gridSize")
-        elapsed_ms = payload.get("elapsedMs")
-
-        try:
-            grid_size_int = int(grid_size)
-            elapsed_ms_int = int(elapsed_ms)
-        except (TypeError, ValueError):
+        submission = SCHULTE_SUBMISSION.decode_request(request)
+        if submission is None:
             return jsonify({"error": "成绩数据格式不正确。"}), 400
+        grid_size_int, elapsed_ms_int = submission
 
         if not (3 <= grid_size_int <= 9):
             return jsonify({"error": "表格大小需在 3 到 9 之间。"}), 400
@@ -470,9 +1109,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取个人成绩失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [serialize_reaction_record(item) for item in records]
-        })
+        return jsonify({"records": records})
 
     @app.get("/api/reaction/leaderboard")
     def reaction_leaderboard() -> Any:
@@ -481,11 +1118,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取排行榜失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [
-                serialize_reaction_record(item, include_username=True) for item in records
-            ]
-        })
+        return jsonify({"records": records})
 
     @app.post("/api/reaction/records")
     def submit_reaction_record() -> Any:
@@ -493,13 +1126,10 @@ def create_app() -> Flask:
         if not account:
             return jsonify({"error": "未登录"}), 401
 
-        payload = request.get_json(silent=True) or {}
-        reaction_time_ms = payload.get("reactionTimeMs")
-
-        try:
-            reaction_time_ms_int = int(reaction_time_ms)
-        except (TypeError, ValueError):
+        submission = REACTION_SUBMISSION.decode_request(request)
+        if submission is None:
             return jsonify({"error": "成绩数据格式不正确。"}), 400
+        (reaction_time_ms_int,) = submission
 
         if reaction_time_ms_int <= 0:
             return jsonify({"error": "成绩必须大于 0。"}), 400
@@ -539,9 +1169,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取个人成绩失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [serialize_memory_flip_record(item) for item in records]
-        })
+        return jsonify({"records": records})
 
     @app.get("/api/memory-flip/leaderboard")
     def memory_flip_leaderboard() -> Any:
@@ -550,11 +1178,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取排行榜失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [
-                serialize_memory_flip_record(item, include_username=True) for item in records
-            ]
-        })
+        return jsonify({"records": records})
 
     @app.post("/api/memory-flip/records")
     def submit_memory_record() -> Any:
@@ -562,15 +1186,10 @@ def create_app() -> Flask:
         if not account:
             return jsonify({"error": "未登录"}), 401
 
-        payload = request.get_json(silent=True) or {}
-        elapsed_ms = payload.get("elapsedMs")
-        moves = payload.get("moves")
-
-        try:
-            elapsed_ms_int = int(elapsed_ms)
-            moves_int = int(moves)
-        except (TypeError, ValueError):
+        submission = MEMORY_FLIP_SUBMISSION.decode_request(request)
+        if submission is None:
             return jsonify({"error": "成绩数据格式不正确。"}), 400
+        elapsed_ms_int, moves_int = submission
 
         if elapsed_ms_int <= 0 or moves_int <= 0:
             return jsonify({"error": "成绩必须大于 0。"}), 400
@@ -611,9 +1230,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取个人成绩失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [serialize_sudoku_record(item) for item in records]
-        })
+        return jsonify({"records": records})
 
     @app.get("/api/sudoku/leaderboard")
     def sudoku_leaderboard() -> Any:
@@ -622,11 +1239,7 @@ def create_app() -> Flask:
         except sqlite3.Error as error:
             return jsonify({"error": "获取排行榜失败", "details": str(error)}), 500
 
-        return jsonify({
-            "records": [
-                serialize_sudoku_record(item, include_username=True) for item in records
-            ]
-        })
+        return jsonify({"records": records})
 
     @app.post("/api/sudoku/records")
     def submit_sudoku_record() -> Any:
@@ -634,20 +1247,15 @@ def create_app() -> Flask:
         if not account:
             return jsonify({"error": "未登录"}), 401
 
-        payload = request.get_json(silent=True) or {}
-        difficulty = (payload.get("difficulty") or "").strip()
-        elapsed_ms = payload.get("elapsedMs")
-        mistakes = payload.get("mistakes")
+        submission = SUDOKU_SUBMISSION.decode_request(request)
+        if submission is None:
+            return jsonify({"error": "成绩数据格式不正确。"}), 400
+        difficulty, elapsed_ms_int, mistakes_int = submission
+        difficulty = difficulty.strip()
 
         if difficulty not in {"easy", "medium", "hard"}:
             return jsonify({"error": "难度参数不正确。"}), 400
 
-        try:
-            elapsed_ms_int = int(elapsed_ms)
-            mistakes_int = int(mistakes)
-        except (TypeError, ValueError):
-            return jsonify({"error": "成绩数据格式不正确。"}), 400
-
         if elapsed_ms_int <= 0 or mistakes_int < 0:
             return jsonify({"error": "成绩必须为有效正数。"}), 400
 
@@ -692,8 +1300,8 @@ def create_app() -> Flask:
                     break
                 if message is None:
                     break
-                if isinstance(message, str) and message.strip().lower() == "ping":
-                    ws.send(json.dumps({"type": "pong"}, ensure_ascii=False))
+                if is_ping(message):
+                    send_ws(ws, PONG_MESSAGE)
         finally:
             liars_bar_manager.unregister_socket(ws)
 
@@ -702,7 +1310,7 @@ def create_app() -> Flask:
         if online_user_notifier is None:
             return
 
-        online_user_notifier.register(ws)
+        online_user_notifier.register(ws, resolve_ws_format(request.args.get("format")))
         try:
             while True:
                 try:
@@ -711,8 +1319,8 @@ def create_app() -> Flask:
                     break
                 if message is None:
                     break
-                if isinstance(message, str) and message.strip().lower() == "ping":
-                    ws.send(json.dumps({"type": "pong"}, ensure_ascii=False))
+                if is_ping(message):
+                    send_ws(ws, PONG_MESSAGE)
         finally:
             online_user_notifier.unregister(ws)
 
@@ -723,7 +1331,7 @@ def create_app() -> Flask:
             return
 
         username = account["username"]
-        chat_manager.register(ws, username)
+        chat_manager.register(ws, username, resolve_ws_format(request.args.get("format")))
 
         try:
             while True:
@@ -733,9 +1341,18 @@ def create_app() -> Flask:
                     break
                 if message is None:
                     break
+                if not message:
+                    continue
+                # 超长消息不做解析，只提示发送者
+                if len(message) > CHAT_MAX_INBOUND_MESSAGE_SIZE:
+                    chat_manager.send_system_message(ws, "消息过长，未发送")
+                    continue
+                if is_ping(message):
+                    send_ws(ws, PONG_MESSAGE)
+                    continue
 
                 try:
-                    data = json.loads(message)
+                    data = loads_json(message)
                     if data.get("type") == "chat_message":
                         text = data.get("payload", {}).get("text", "").strip()
                         if text:
@@ -753,25 +1370,74 @@ def create_app() -> Flask:
         if path.startswith("api/"):
             abort(404)
 
-        requested_path = (FRONTEND_DIR / path).resolve()
-        try:
-            requested_path.relative_to(FRONTEND_DIR)
-        except ValueError:
+        resolved = resolve_frontend_path(path)
+        if resolved is None:
             abort(404)
 
-        if not requested_path.exists():
-            abort(404)
+        directory, filename = resolved
+        asset = load_static_asset(directory / filename)
+        if asset is None:
+            # 路径已由 resolve_frontend_path 校验，直接交给 send_file；
+            # gunicorn 默认启用 sendfile，文件内容不经过用户态拷贝
+            response = send_file(directory / filename, conditional=True, etag=True)
+        else:
+            body, mimetype, etag = asset
+            response = app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.make_conditional(request)
+        if HASHED_ASSET_PATTERN.search(filename):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+    return app
 
-        if requested_path.is_dir():
-            requested_path = requested_path / "index.html"
-            if not requested_path.exists():
-                abort(404)
 
-        relative_path = requested_path.relative_to(FRONTEND_DIR)
-        directory = requested_path.parent
-        return send_from_directory(directory, relative_path.name)
+@lru_cache(maxsize=1)
+def frontend_index() -> dict[str, tuple[Path, str]]:
+    # 前端文件在运行期间不会变化，启动时扫描一次，之后每个请求只做一次字典查找
+    index: dict[str, tuple[Path, str]] = {}
+    for root, dirs, files in os.walk(FRONTEND_DIR):
+        root_path = Path(root)
+        relative_root = root_path.relative_to(FRONTEND_DIR)
+        at_root = relative_root == Path(".")
+        allowed_suffixes = FRONTEND_ROOT_SUFFIXES if at_root else STATIC_CACHE_SUFFIXES
+        dirs[:] = [
+            name
+            for name in dirs
+            if not name.startswith(".") and (not at_root or name in FRONTEND_ASSET_DIRS)
+        ]
+        for name in files:
+            if name.startswith("."):
+                continue
+            if os.path.splitext(name)[1].lower() not in allowed_suffixes:
+                continue
+            entry = (root_path, name)
+            index[(relative_root / name).as_posix()] = entry
+            if name == "index.html" and not at_root:
+                directory = relative_root.as_posix()
+                index[directory] = index[f"{directory}/"] = entry
+    return index
+
+
+def resolve_frontend_path(path: str) -> Optional[tuple[Path, str]]:
+    return frontend_index().get(path)
+
+
+@lru_cache(maxsize=256)
+def load_static_asset(file_path: Path) -> Optional[tuple[bytes, str, str]]:
+    # 常见前端资源读入内存后直接返回，超过大小上限或其他类型的文件仍走 send_file
+    if file_path.suffix.lower() not in STATIC_CACHE_SUFFIXES:
+        return None
+    try:
+        if file_path.stat().st_size > STATIC_CACHE_MAX_FILE_BYTES:
+            return None
+        body = file_path.read_bytes()
+    except OSError:
+        return None
 
-    return app
+    mimetype = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return body, mimetype, etag
 
 
 def init_db(database_path: Path) -> None:
@@ -801,11 +1467,13 @@ def init_db(database_path: Path) -> None:
             )
             """
         )
+        # token 上的 UNIQUE 约束已自带索引，额外的 idx_sessions_token 只会拖慢写入
+        connection.execute("DROP INDEX IF EXISTS idx_sessions_token")
         connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(token)"
+            "CREATE INDEX IF NOT EXISTS idx_sessions_account ON sessions(account_id)"
         )
         connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_sessions_account ON sessions(account_id)"
+            "CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions(last_seen)"
         )
         connection.execute(
             """
@@ -837,8 +1505,14 @@ def init_db(database_path: Path) -> None:
             )
             """
         )
+        # 排行榜索引与 ORDER BY 列完全一致，查询按索引顺序扫描，无需临时排序；
+        # 旧的单列索引是其前缀，保留只会拖慢写入
+        connection.execute("DROP INDEX IF EXISTS idx_schulte_records_elapsed")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_schulte_records_board ON schulte_records(elapsed_ms, updated_at)"
+        )
         connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_schulte_records_elapsed ON schulte_records(elapsed_ms)"
+            "CREATE INDEX IF NOT EXISTS idx_schulte_records_account_best ON schulte_records(account_id, elapsed_ms, updated_at)"
         )
         connection.execute(
             """
@@ -853,8 +1527,9 @@ def init_db(database_path: Path) -> None:
             )
             """
         )
+        connection.execute("DROP INDEX IF EXISTS idx_reaction_records_time")
         connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_reaction_records_time ON reaction_records(reaction_time_ms)"
+            "CREATE INDEX IF NOT EXISTS idx_reaction_records_board ON reaction_records(reaction_time_ms, updated_at)"
         )
         connection.execute(
             """
@@ -870,8 +1545,9 @@ def init_db(database_path: Path) -> None:
             )
             """
         )
+        connection.execute("DROP INDEX IF EXISTS idx_memory_flip_elapsed")
         connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_memory_flip_elapsed ON memory_flip_records(elapsed_ms)"
+            "CREATE INDEX IF NOT EXISTS idx_memory_flip_board ON memory_flip_records(elapsed_ms, moves, updated_at)"
         )
         connection.execute(
             """
@@ -888,8 +1564,9 @@ def init_db(database_path: Path) -> None:
             )
             """
         )
+        connection.execute("DROP INDEX IF EXISTS idx_sudoku_records_elapsed")
         connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_sudoku_records_elapsed ON sudoku_records(elapsed_ms)"
+            "CREATE INDEX IF NOT EXISTS idx_sudoku_records_board ON sudoku_records(elapsed_ms, mistakes, updated_at)"
         )
         connection.execute(
             """
@@ -902,33 +1579,142 @@ def init_db(database_path: Path) -> None:
             )
             """
         )
+        # 活动列表把 details 原样嵌入响应，只能存合法的 JSON。新记录写入时由 dumps_json 编码，
+        # 旧版本留下的无法解析的记录在这里一次性改为 {}，与读取时的兜底一致
+        if connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+            invalid_ids: list[tuple[int]] = []
+            for activity_id, details_raw in connection.execute("SELECT id, details FROM activities"):
+                try:
+                    loads_json(details_raw)
+                except (json.JSONDecodeError, TypeError):
+                    invalid_ids.append((activity_id,))
+            connection.executemany("UPDATE activities SET details = '{}' WHERE id = ?", invalid_ids)
+            connection.execute("PRAGMA user_version = 1")
         connection.commit()
+        # WAL 模式下写入不会阻塞读取；journal_mode 会持久化在数据库文件中
+        connection.execute("PRAGMA journal_mode = WAL")
 
 
-def get_db_connection() -> sqlite3.Connection:
-    connection = sqlite3.connect(DATABASE_PATH)
+# Werkzeug 的多线程服务器每个请求都在新线程中处理，连接放在进程级的池里复用，
+# PRAGMA 只在建立连接时执行一次，语句缓存也不会随线程结束而丢失
+_db_pool: queue.LifoQueue[tuple[Path, sqlite3.Connection]] = queue.LifoQueue(
+    maxsize=SQLITE_POOL_SIZE
+)
+
+
+def _open_db_connection(database_path: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        database_path,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
     connection.row_factory = sqlite3.Row
     connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("PRAGMA busy_timeout = 5000")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB}")
+    # 通过 mmap 读取数据库页，读操作直接命中操作系统页缓存
+    connection.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    connection.execute("PRAGMA temp_store = MEMORY")
     return connection
 
 
+@contextmanager
+def get_db_connection() -> Iterator[sqlite3.Connection]:
+    # 借出的连接同一时间只被一个线程使用；块正常结束时提交，出错时回滚，然后归还连接池
+    database_path = DATABASE_PATH
+    connection: Optional[sqlite3.Connection] = None
+    try:
+        pooled_path, pooled = _db_pool.get_nowait()
+    except queue.Empty:
+        pass
+    else:
+        if pooled_path == database_path:
+            connection = pooled
+        else:
+            pooled.close()
+    if connection is None:
+        connection = _open_db_connection(database_path)
+
+    try:
+        with connection:
+            yield connection
+    finally:
+        try:
+            _db_pool.put_nowait((database_path, connection))
+        except queue.Full:
+            connection.close()
+
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    if password_hasher is not None:
+        return password_hasher.hash(password)
+
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    derived = _scrypt(password, salt, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return "$".join(
+        (
+            PASSWORD_SCRYPT_PREFIX,
+            str(PASSWORD_SCRYPT_N),
+            str(PASSWORD_SCRYPT_R),
+            str(PASSWORD_SCRYPT_P),
+            base64.b64encode(salt).decode("ascii"),
+            base64.b64encode(derived).decode("ascii"),
+        )
+    )
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return hash_password(password) == password_hash
+    if password_hash.startswith(PASSWORD_ARGON2_PREFIX):
+        if password_hasher is None:
+            return False
+        try:
+            return password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    if password_hash.startswith(f"{PASSWORD_SCRYPT_PREFIX}$"):
+        return _verify_scrypt(password, password_hash)
+
+    # 兼容旧版未加盐的 SHA-256 哈希，登录成功后会升级
+    return hmac.compare_digest(_legacy_hash_password(password), password_hash)
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    if password_hasher is None:
+        return not password_hash.startswith(f"{PASSWORD_SCRYPT_PREFIX}$")
+    if not password_hash.startswith(PASSWORD_ARGON2_PREFIX):
+        return True
+    return password_hasher.check_needs_rehash(password_hash)
+
+
+def _verify_scrypt(password: str, password_hash: str) -> bool:
+    try:
+        _, n, r, p, salt_b64, derived_b64 = password_hash.split("$")
+        salt = base64.b64decode(salt_b64)
+        expected = base64.b64decode(derived_b64)
+        derived = _scrypt(password, salt, int(n), int(r), int(p), dklen=len(expected))
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, expected)
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, dklen: int = PASSWORD_SCRYPT_DKLEN) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=dklen)
+
+
+def _legacy_hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
 
 
 def create_account(username: str, password_hash: str, phone: str) -> Dict[str, Any]:
-    created_at = datetime.now(timezone.utc).isoformat()
+    created_at = now_iso()
     with get_db_connection() as connection:
         cursor = connection.execute(
             "INSERT INTO accounts (username, password_hash, phone, created_at) VALUES (?, ?, ?, ?)",
             (username, password_hash, phone, created_at),
         )
         account_id = cursor.lastrowid
-        connection.commit()
 
     return {
         "id": account_id,
@@ -938,6 +1724,14 @@ def create_account(username: str, password_hash: str, phone: str) -> Dict[str, A
     }
 
 
+def update_account_password_hash(account_id: int, password_hash: str) -> None:
+    with get_db_connection() as connection:
+        connection.execute(
+            "UPDATE accounts SET password_hash = ? WHERE id = ?",
+            (password_hash, account_id),
+        )
+
+
 def fetch_account_by_username(username: str) -> Optional[Dict[str, Any]]:
     with get_db_connection() as connection:
         row = connection.execute(
@@ -950,6 +1744,10 @@ def fetch_account_by_username(username: str) -> Optional[Dict[str, Any]]:
 
 
 def fetch_account_by_session_token(token: str) -> Optional[Dict[str, Any]]:
+    account = session_account_cache.get(token)
+    if account is not None:
+        return account
+
     with get_db_connection() as connection:
         row = connection.execute(
             """
@@ -962,7 +1760,9 @@ def fetch_account_by_session_token(token: str) -> Optional[Dict[str, Any]]:
         ).fetchone()
     if not row:
         return None
-    return dict(row)
+    account = dict(row)
+    session_account_cache.put(token, account)
+    return account
 
 
 def fetch_account_public(username: str) -> Optional[Dict[str, Any]]:
@@ -978,67 +1778,102 @@ def fetch_account_public(username: str) -> Optional[Dict[str, Any]]:
 
 def create_session(account_id: int) -> str:
     token = secrets.token_urlsafe(32)
-    timestamp = datetime.now(timezone.utc).isoformat()
+    timestamp = now_iso()
     with get_db_connection() as connection:
         connection.execute(
             "INSERT INTO sessions (token, account_id, created_at, last_seen) VALUES (?, ?, ?, ?)",
             (token, account_id, timestamp, timestamp),
         )
-        connection.commit()
     notify_online_users_change()
     return token
 
 
 def update_session_last_seen(token: str) -> bool:
-    timestamp = datetime.now(timezone.utc).isoformat()
-    with get_db_connection() as connection:
-        cursor = connection.execute(
-            "UPDATE sessions SET last_seen = ? WHERE token = ?",
-            (timestamp, token),
-        )
-        connection.commit()
+    timestamp = now_iso()
+    if last_seen_buffer is None:
+        with get_db_connection() as connection:
+            cursor = connection.execute(
+                "UPDATE sessions SET last_seen = ? WHERE token = ?",
+                (timestamp, token),
+            )
         if cursor.rowcount > 0:
             notify_online_users_change()
             return True
         return False
 
+    # 心跳只写入内存缓冲区，由后台线程批量落库；
+    # 令牌已在缓冲区或会话缓存中时直接视为有效，否则做一次轻量的有效性查询
+    account_id = last_seen_buffer.account_id_for(token)
+    if account_id is None:
+        cached = session_account_cache.get(token)
+        if cached is not None:
+            account_id = int(cached["id"])
+    if account_id is None:
+        with get_db_connection() as connection:
+            row = connection.execute(
+                "SELECT account_id FROM sessions WHERE token = ?",
+                (token,),
+            ).fetchone()
+        if not row:
+            last_seen_buffer.discard(token)
+            session_account_cache.discard(token)
+            return False
+        account_id = int(row["account_id"])
+
+    last_seen_buffer.touch(token, account_id, timestamp)
+    return True
+
 
 def delete_session(token: str) -> None:
+    session_account_cache.discard(token)
+    if last_seen_buffer is not None:
+        last_seen_buffer.discard(token)
     with get_db_connection() as connection:
         connection.execute("DELETE FROM sessions WHERE token = ?", (token,))
-        connection.commit()
     notify_online_users_change()
 
 
+def delete_expired_sessions() -> int:
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=SESSION_MAX_AGE)).isoformat()
+    with get_db_connection() as connection:
+        cursor = connection.execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,))
+    if cursor.rowcount > 0:
+        online_users_cache.invalidate()
+    return cursor.rowcount
+
+
 def list_online_users() -> list[Dict[str, Any]]:
-    threshold = datetime.now(timezone.utc) - timedelta(seconds=ONLINE_THRESHOLD_SECONDS)
+    threshold = (
+        datetime.now(timezone.utc) - timedelta(seconds=ONLINE_THRESHOLD_SECONDS)
+    ).isoformat()
     users: list[Dict[str, Any]] = []
+    pending_last_seen = last_seen_buffer.latest_by_account() if last_seen_buffer else {}
     with get_db_connection() as connection:
+        # 时间戳统一为 UTC ISO 字符串，可直接在 SQL 中按字典序比较
         rows = connection.execute(
             """
             SELECT
+                accounts.id,
                 accounts.username,
                 accounts.phone,
                 accounts.created_at,
-                MAX(sessions.last_seen) AS last_seen
+                MAX(sessions.last_seen) AS last_seen,
+                MAX(sessions.last_seen) >= ? AS online
             FROM accounts
             LEFT JOIN sessions ON sessions.account_id = accounts.id
             GROUP BY accounts.id
             ORDER BY accounts.username COLLATE NOCASE
             """,
+            (threshold,),
         ).fetchall()
 
     for row in rows:
         last_seen_str = row["last_seen"]
-        last_seen_dt: Optional[datetime] = None
-        if last_seen_str:
-            try:
-                last_seen_dt = datetime.fromisoformat(last_seen_str)
-            except ValueError:
-                last_seen_dt = None
-            if last_seen_dt and last_seen_dt.tzinfo is None:
-                last_seen_dt = last_seen_dt.replace(tzinfo=timezone.utc)
-        is_online = bool(last_seen_dt and last_seen_dt >= threshold)
+        is_online = bool(row["online"])
+        pending = pending_last_seen.get(row["id"])
+        if pending and (not last_seen_str or pending > last_seen_str):
+            last_seen_str = pending
+            is_online = pending >= threshold
 
         users.append(
             {
@@ -1063,8 +1898,8 @@ def serialize_account(account: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def create_activity(account_id: int, category: str, action: str, details: Dict[str, Any]) -> Dict[str, Any]:
-    timestamp = datetime.now(timezone.utc).isoformat()
-    details_json = json.dumps(details, ensure_ascii=False)
+    timestamp = now_iso()
+    details_json = dumps_json(details)
     with get_db_connection() as connection:
         cursor = connection.execute(
             """
@@ -1074,7 +1909,6 @@ def create_activity(account_id: int, category: str, action: str, details: Dict[s
             (account_id, category, action, details_json, timestamp),
         )
         activity_id = cursor.lastrowid
-        connection.commit()
 
     return {
         "id": activity_id,
@@ -1109,10 +1943,16 @@ def list_user_activities(username: str, category: Optional[str] = None, limit: i
 
     for row in rows:
         details_raw = row["details"]
-        try:
-            details = json.loads(details_raw) if details_raw else {}
-        except json.JSONDecodeError:
+        if not details_raw:
             details = {}
+        elif JSON_FRAGMENT is not None:
+            # details 在写入时已编码为 JSON，原样嵌入响应，省去一次解析和重新编码
+            details = JSON_FRAGMENT(details_raw)
+        else:
+            try:
+                details = loads_json(details_raw)
+            except json.JSONDecodeError:
+                details = {}
         items.append(
             {
                 "id": row["id"],
@@ -1137,96 +1977,77 @@ def serialize_activity(activity: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def serialize_schulte_record(
-    record: Dict[str, Any], *, include_username: bool = False
-) -> Dict[str, Any]:
-    payload = {
-        "id": record.get("id"),
-        "gridSize": record.get("grid_size"),
-        "elapsedMs": record.get("elapsed_ms"),
-        "createdAt": record.get("created_at"),
-        "updatedAt": record.get("updated_at"),
+def serialize_schulte_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": record["id"],
+        "gridSize": record["grid_size"],
+        "elapsedMs": record["elapsed_ms"],
+        "createdAt": record["created_at"],
+        "updatedAt": record["updated_at"],
     }
-    if include_username and record.get("username"):
-        payload["username"] = record["username"]
-    return payload
-
-
-def serialize_reaction_record(
-    record: Dict[str, Any], *, include_username: bool = False
-) -> Dict[str, Any]:
-    payload = {
-        "id": record.get("id"),
-        "reactionTimeMs": record.get("reaction_time_ms"),
-        "createdAt": record.get("created_at"),
-        "updatedAt": record.get("updated_at"),
+
+
+def serialize_reaction_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": record["id"],
+        "reactionTimeMs": record["reaction_time_ms"],
+        "createdAt": record["created_at"],
+        "updatedAt": record["updated_at"],
     }
-    if include_username and record.get("username"):
-        payload["username"] = record["username"]
-    return payload
-
-
-def serialize_memory_flip_record(
-    record: Dict[str, Any], *, include_username: bool = False
-) -> Dict[str, Any]:
-    payload = {
-        "id": record.get("id"),
-        "elapsedMs": record.get("elapsed_ms"),
-        "moves": record.get("moves"),
-        "createdAt": record.get("created_at"),
-        "updatedAt": record.get("updated_at"),
+
+
+def serialize_memory_flip_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": record["id"],
+        "elapsedMs": record["elapsed_ms"],
+        "moves": record["moves"],
+        "createdAt": record["created_at"],
+        "updatedAt": record["updated_at"],
     }
-    if include_username and record.get("username"):
-        payload["username"] = record["username"]
-    return payload
-
-
-def serialize_sudoku_record(
-    record: Dict[str, Any], *, include_username: bool = False
-) -> Dict[str, Any]:
-    payload = {
-        "id": record.get("id"),
-        "difficulty": record.get("difficulty"),
-        "elapsedMs": record.get("elapsed_ms"),
-        "mistakes": record.get("mistakes"),
-        "createdAt": record.get("created_at"),
-        "updatedAt": record.get("updated_at"),
+
+
+def serialize_sudoku_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": record["id"],
+        "difficulty": record["difficulty"],
+        "elapsedMs": record["elapsed_ms"],
+        "mistakes": record["mistakes"],
+        "createdAt": record["created_at"],
+        "updatedAt": record["updated_at"],
     }
-    if include_username and record.get("username"):
-        payload["username"] = record["username"]
-    return payload
 
 
 def upsert_schulte_record(
     *, account_id: int, grid_size: int, elapsed_ms: int
 ) -> tuple[Dict[str, Any], bool]:
-    now = datetime.now(timezone.utc).isoformat()
+    now = now_iso()
     with get_db_connection() as connection:
         existing = connection.execute(
             """
-            SELECT id, elapsed_ms
+            SELECT id, account_id, grid_size, elapsed_ms, created_at, updated_at
             FROM schulte_records
             WHERE account_id = ? AND grid_size = ?
             """,
             (account_id, grid_size),
         ).fetchone()
 
-        improved = False
-        record_id: Optional[int]
+        # 没有刷新纪录时直接返回已有记录，只需一次查询
+        if existing and int(existing["elapsed_ms"]) <= elapsed_ms:
+            return dict(existing), False
 
         if existing:
-            if int(existing["elapsed_ms"]) > elapsed_ms:
-                connection.execute(
-                    """
-                    UPDATE schulte_records
-                    SET elapsed_ms = ?, updated_at = ?
-                    WHERE id = ?
-                    """,
-                    (elapsed_ms, now, existing["id"]),
-                )
-                connection.commit()
-                improved = True
-            record_id = int(existing["id"])
+            # 条件写在 UPDATE 中，并发提交时只有真正更好的成绩会生效
+            cursor = connection.execute(
+                """
+                UPDATE schulte_records
+                SET elapsed_ms = ?, updated_at = ?
+                WHERE id = ? AND elapsed_ms > ?
+                """,
+                (elapsed_ms, now, existing["id"], elapsed_ms),
+            )
+            if cursor.rowcount > 0:
+                # 写入的值都已知，直接在内存中拼出最新记录，省去回读
+                return {**dict(existing), "elapsed_ms": elapsed_ms, "updated_at": now}, True
         else:
             cursor = connection.execute(
                 """
@@ -1237,110 +2058,110 @@ def upsert_schulte_record(
                 """,
                 (account_id, grid_size, elapsed_ms, now, now),
             )
-            connection.commit()
-            record_id = cursor.lastrowid
-            improved = True
+            return (
+                {
+                    "id": cursor.lastrowid,
+                    "account_id": account_id,
+                    "grid_size": grid_size,
+                    "elapsed_ms": elapsed_ms,
+                    "created_at": now,
+                    "updated_at": now,
+                },
+                True,
+            )
 
+        # 只有并发提交抢先写入了更好的成绩时才需要重新读取
         row = connection.execute(
             """
             SELECT id, account_id, grid_size, elapsed_ms, created_at, updated_at
             FROM schulte_records
             WHERE id = ?
             """,
-            (record_id,),
+            (existing["id"],),
         ).fetchone()
 
     if not row:
         raise sqlite3.Error("未能保存舒尔特成绩")
 
-    return dict(row), improved
+    return dict(row), False
 
 
-def list_schulte_records_by_account(*, account_id: int) -> list[Dict[str, Any]]:
+def list_schulte_records_by_account(*, account_id: int) -> list[sqlite3.Row]:
+    # 列名与 serialize_schulte_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
-            SELECT id, account_id, grid_size, elapsed_ms, created_at, updated_at
+            SELECT id, grid_size AS gridSize, elapsed_ms AS elapsedMs, created_at AS createdAt, updated_at AS updatedAt
             FROM schulte_records
             WHERE account_id = ?
             ORDER BY grid_size ASC
             """,
             (account_id,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
-def list_schulte_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
+def list_schulte_leaderboard(limit: int = 20) -> list[sqlite3.Row]:
+    # 每个账号只取最好的一条成绩（用时最短，其次更新时间最早），筛选、排序和截断都在 SQL 中完成；
+    # 列名与 serialize_schulte_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
             SELECT
                 sr.id,
-                sr.account_id,
-                sr.grid_size,
-                sr.elapsed_ms,
-                sr.created_at,
-                sr.updated_at,
+                sr.grid_size AS gridSize,
+                sr.elapsed_ms AS elapsedMs,
+                sr.created_at AS createdAt,
+                sr.updated_at AS updatedAt,
                 a.username
             FROM schulte_records sr
             JOIN accounts a ON sr.account_id = a.id
+            WHERE sr.id = (
+                SELECT best.id
+                FROM schulte_records best
+                WHERE best.account_id = sr.account_id
+                ORDER BY best.elapsed_ms ASC, best.updated_at ASC
+                LIMIT 1
+            )
             ORDER BY sr.elapsed_ms ASC, sr.updated_at ASC
+            LIMIT ?
             """,
+            (limit,),
         ).fetchall()
-
-    best_by_account: Dict[int, Dict[str, Any]] = {}
-    for row in rows:
-        account_id = int(row["account_id"])
-        existing = best_by_account.get(account_id)
-        if existing is None:
-            best_by_account[account_id] = dict(row)
-            continue
-        if int(row["elapsed_ms"]) < int(existing["elapsed_ms"]):
-            best_by_account[account_id] = dict(row)
-        elif (
-            int(row["elapsed_ms"]) == int(existing["elapsed_ms"])
-            and str(row["updated_at"]) < str(existing["updated_at"])
-        ):
-            best_by_account[account_id] = dict(row)
-
-    best = sorted(
-        best_by_account.values(),
-        key=lambda item: (int(item["elapsed_ms"]), str(item["updated_at"]))
-    )
-
-    return best[:limit]
+    return rows
 
 
 def upsert_reaction_record(
     *, account_id: int, reaction_time_ms: int
 ) -> tuple[Dict[str, Any], bool]:
-    now = datetime.now(timezone.utc).isoformat()
+    now = now_iso()
     with get_db_connection() as connection:
         existing = connection.execute(
             """
-            SELECT id, reaction_time_ms
+            SELECT id, account_id, reaction_time_ms, created_at, updated_at
             FROM reaction_records
             WHERE account_id = ?
             """,
             (account_id,),
         ).fetchone()
 
-        improved = False
-        record_id: Optional[int]
+        # 没有刷新纪录时直接返回已有记录，只需一次查询
+        if existing and int(existing["reaction_time_ms"]) <= reaction_time_ms:
+            return dict(existing), False
 
         if existing:
-            if int(existing["reaction_time_ms"]) > reaction_time_ms:
-                connection.execute(
-                    """
-                    UPDATE reaction_records
-                    SET reaction_time_ms = ?, updated_at = ?
-                    WHERE id = ?
-                    """,
-                    (reaction_time_ms, now, existing["id"]),
-                )
-                connection.commit()
-                improved = True
-            record_id = int(existing["id"])
+            # 条件写在 UPDATE 中，并发提交时只有真正更好的成绩会生效
+            cursor = connection.execute(
+                """
+                UPDATE reaction_records
+                SET reaction_time_ms = ?, updated_at = ?
+                WHERE id = ? AND reaction_time_ms > ?
+                """,
+                (reaction_time_ms, now, existing["id"], reaction_time_ms),
+            )
+            if cursor.rowcount > 0:
+                # 写入的值都已知，直接在内存中拼出最新记录，省去回读
+                return {**dict(existing), "reaction_time_ms": reaction_time_ms, "updated_at": now}, True
         else:
             cursor = connection.execute(
                 """
@@ -1351,49 +2172,58 @@ def upsert_reaction_record(
                 """,
                 (account_id, reaction_time_ms, now, now),
             )
-            connection.commit()
-            record_id = cursor.lastrowid
-            improved = True
+            return (
+                {
+                    "id": cursor.lastrowid,
+                    "account_id": account_id,
+                    "reaction_time_ms": reaction_time_ms,
+                    "created_at": now,
+                    "updated_at": now,
+                },
+                True,
+            )
 
+        # 只有并发提交抢先写入了更好的成绩时才需要重新读取
         row = connection.execute(
             """
             SELECT id, account_id, reaction_time_ms, created_at, updated_at
             FROM reaction_records
             WHERE id = ?
             """,
-            (record_id,),
+            (existing["id"],),
         ).fetchone()
 
     if not row:
         raise sqlite3.Error("未能保存反应力成绩")
 
-    return dict(row), improved
+    return dict(row), False
 
 
-def list_reaction_records_by_account(*, account_id: int) -> list[Dict[str, Any]]:
+def list_reaction_records_by_account(*, account_id: int) -> list[sqlite3.Row]:
+    # 列名与 serialize_reaction_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
-            SELECT id, account_id, reaction_time_ms, created_at, updated_at
+            SELECT id, reaction_time_ms AS reactionTimeMs, created_at AS createdAt, updated_at AS updatedAt
             FROM reaction_records
             WHERE account_id = ?
             ORDER BY reaction_time_ms ASC
             """,
             (account_id,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
-def list_reaction_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
+def list_reaction_leaderboard(limit: int = 20) -> list[sqlite3.Row]:
+    # 列名与 serialize_reaction_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
             SELECT
                 rr.id,
-                rr.account_id,
-                rr.reaction_time_ms,
-                rr.created_at,
-                rr.updated_at,
+                rr.reaction_time_ms AS reactionTimeMs,
+                rr.created_at AS createdAt,
+                rr.updated_at AS updatedAt,
                 a.username
             FROM reaction_records rr
             JOIN accounts a ON rr.account_id = a.id
@@ -1402,44 +2232,40 @@ def list_reaction_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
             """,
             (limit,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
 def upsert_memory_flip_record(
     *, account_id: int, elapsed_ms: int, moves: int
 ) -> tuple[Dict[str, Any], bool]:
-    now = datetime.now(timezone.utc).isoformat()
+    now = now_iso()
     with get_db_connection() as connection:
         existing = connection.execute(
             """
-            SELECT id, elapsed_ms, moves
+            SELECT id, account_id, elapsed_ms, moves, created_at, updated_at
             FROM memory_flip_records
             WHERE account_id = ?
             """,
             (account_id,),
         ).fetchone()
 
-        improved = False
-        record_id: Optional[int]
+        # 没有刷新纪录时直接返回已有记录，只需一次查询
+        if existing and (int(existing["elapsed_ms"]), int(existing["moves"])) <= (elapsed_ms, moves):
+            return dict(existing), False
 
         if existing:
-            better_time = int(existing["elapsed_ms"]) > elapsed_ms
-            same_time_better_moves = (
-                int(existing["elapsed_ms"]) == elapsed_ms
-                and int(existing["moves"]) > moves
+            # 条件写在 UPDATE 中，并发提交时只有真正更好的成绩会生效
+            cursor = connection.execute(
+                """
+                UPDATE memory_flip_records
+                SET elapsed_ms = ?, moves = ?, updated_at = ?
+                WHERE id = ? AND (elapsed_ms > ? OR (elapsed_ms = ? AND moves > ?))
+                """,
+                (elapsed_ms, moves, now, existing["id"], elapsed_ms, elapsed_ms, moves),
             )
-            if better_time or same_time_better_moves:
-                connection.execute(
-                    """
-                    UPDATE memory_flip_records
-                    SET elapsed_ms = ?, moves = ?, updated_at = ?
-                    WHERE id = ?
-                    """,
-                    (elapsed_ms, moves, now, existing["id"]),
-                )
-                connection.commit()
-                improved = True
-            record_id = int(existing["id"])
+            if cursor.rowcount > 0:
+                # 写入的值都已知，直接在内存中拼出最新记录，省去回读
+                return {**dict(existing), "elapsed_ms": elapsed_ms, "moves": moves, "updated_at": now}, True
         else:
             cursor = connection.execute(
                 """
@@ -1450,50 +2276,60 @@ def upsert_memory_flip_record(
                 """,
                 (account_id, elapsed_ms, moves, now, now),
             )
-            connection.commit()
-            record_id = cursor.lastrowid
-            improved = True
+            return (
+                {
+                    "id": cursor.lastrowid,
+                    "account_id": account_id,
+                    "elapsed_ms": elapsed_ms,
+                    "moves": moves,
+                    "created_at": now,
+                    "updated_at": now,
+                },
+                True,
+            )
 
+        # 只有并发提交抢先写入了更好的成绩时才需要重新读取
         row = connection.execute(
             """
             SELECT id, account_id, elapsed_ms, moves, created_at, updated_at
             FROM memory_flip_records
             WHERE id = ?
             """,
-            (record_id,),
+            (existing["id"],),
         ).fetchone()
 
     if not row:
         raise sqlite3.Error("未能保存翻牌成绩")
 
-    return dict(row), improved
+    return dict(row), False
 
 
-def list_memory_flip_records_by_account(*, account_id: int) -> list[Dict[str, Any]]:
+def list_memory_flip_records_by_account(*, account_id: int) -> list[sqlite3.Row]:
+    # 列名与 serialize_memory_flip_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
-            SELECT id, account_id, elapsed_ms, moves, created_at, updated_at
+            SELECT id, elapsed_ms AS elapsedMs, moves, created_at AS createdAt, updated_at AS updatedAt
             FROM memory_flip_records
             WHERE account_id = ?
             ORDER BY elapsed_ms ASC, moves ASC
             """,
             (account_id,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
-def list_memory_flip_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
+def list_memory_flip_leaderboard(limit: int = 20) -> list[sqlite3.Row]:
+    # 列名与 serialize_memory_flip_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
             SELECT
                 mr.id,
-                mr.account_id,
-                mr.elapsed_ms,
+                mr.elapsed_ms AS elapsedMs,
                 mr.moves,
-                mr.created_at,
-                mr.updated_at,
+                mr.created_at AS createdAt,
+                mr.updated_at AS updatedAt,
                 a.username
             FROM memory_flip_records mr
             JOIN accounts a ON mr.account_id = a.id
@@ -1502,44 +2338,43 @@ def list_memory_flip_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
             """,
             (limit,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
 def upsert_sudoku_record(
     *, account_id: int, difficulty: str, elapsed_ms: int, mistakes: int
 ) -> tuple[Dict[str, Any], bool]:
-    now = datetime.now(timezone.utc).isoformat()
+    now = now_iso()
     with get_db_connection() as connection:
         existing = connection.execute(
             """
-            SELECT id, elapsed_ms, mistakes
+            SELECT id, account_id, difficulty, elapsed_ms, mistakes, created_at, updated_at
             FROM sudoku_records
             WHERE account_id = ? AND difficulty = ?
             """,
             (account_id, difficulty),
         ).fetchone()
 
-        improved = False
-        record_id: Optional[int]
+        # 没有刷新纪录时直接返回已有记录，只需一次查询
+        if existing and (int(existing["elapsed_ms"]), int(existing["mistakes"])) <= (
+            elapsed_ms,
+            mistakes,
+        ):
+            return dict(existing), False
 
         if existing:
-            better_time = int(existing["elapsed_ms"]) > elapsed_ms
-            same_time_better_mistakes = (
-                int(existing["elapsed_ms"]) == elapsed_ms
-                and int(existing["mistakes"]) > mistakes
+            # 条件写在 UPDATE 中，并发提交时只有真正更好的成绩会生效
+            cursor = connection.execute(
+                """
+                UPDATE sudoku_records
+                SET elapsed_ms = ?, mistakes = ?, updated_at = ?
+                WHERE id = ? AND (elapsed_ms > ? OR (elapsed_ms = ? AND mistakes > ?))
+                """,
+                (elapsed_ms, mistakes, now, existing["id"], elapsed_ms, elapsed_ms, mistakes),
             )
-            if better_time or same_time_better_mistakes:
-                connection.execute(
-                    """
-                    UPDATE sudoku_records
-                    SET elapsed_ms = ?, mistakes = ?, updated_at = ?
-                    WHERE id = ?
-                    """,
-                    (elapsed_ms, mistakes, now, existing["id"]),
-                )
-                connection.commit()
-                improved = True
-            record_id = int(existing["id"])
+            if cursor.rowcount > 0:
+                # 写入的值都已知，直接在内存中拼出最新记录，省去回读
+                return {**dict(existing), "elapsed_ms": elapsed_ms, "mistakes": mistakes, "updated_at": now}, True
         else:
             cursor = connection.execute(
                 """
@@ -1550,51 +2385,62 @@ def upsert_sudoku_record(
                 """,
                 (account_id, difficulty, elapsed_ms, mistakes, now, now),
             )
-            connection.commit()
-            record_id = cursor.lastrowid
-            improved = True
+            return (
+                {
+                    "id": cursor.lastrowid,
+                    "account_id": account_id,
+                    "difficulty": difficulty,
+                    "elapsed_ms": elapsed_ms,
+                    "mistakes": mistakes,
+                    "created_at": now,
+                    "updated_at": now,
+                },
+                True,
+            )
 
+        # 只有并发提交抢先写入了更好的成绩时才需要重新读取
         row = connection.execute(
             """
             SELECT id, account_id, difficulty, elapsed_ms, mistakes, created_at, updated_at
             FROM sudoku_records
             WHERE id = ?
             """,
-            (record_id,),
+            (existing["id"],),
         ).fetchone()
 
     if not row:
         raise sqlite3.Error("未能保存数独成绩")
 
-    return dict(row), improved
+    return dict(row), False
 
 
-def list_sudoku_records_by_account(*, account_id: int) -> list[Dict[str, Any]]:
+def list_sudoku_records_by_account(*, account_id: int) -> list[sqlite3.Row]:
+    # 列名与 serialize_sudoku_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
-            SELECT id, account_id, difficulty, elapsed_ms, mistakes, created_at, updated_at
+            SELECT id, difficulty, elapsed_ms AS elapsedMs, mistakes, created_at AS createdAt, updated_at AS updatedAt
             FROM sudoku_records
             WHERE account_id = ?
             ORDER BY difficulty ASC
             """,
             (account_id,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
-def list_sudoku_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
+def list_sudoku_leaderboard(limit: int = 20) -> list[sqlite3.Row]:
+    # 列名与 serialize_sudoku_record 的输出一致，结果行可直接序列化
     with get_db_connection() as connection:
         rows = connection.execute(
             """
             SELECT
                 sr.id,
-                sr.account_id,
                 sr.difficulty,
-                sr.elapsed_ms,
+                sr.elapsed_ms AS elapsedMs,
                 sr.mistakes,
-                sr.created_at,
-                sr.updated_at,
+                sr.created_at AS createdAt,
+                sr.updated_at AS updatedAt,
                 a.username
             FROM sudoku_records sr
             JOIN accounts a ON sr.account_id = a.id
@@ -1603,18 +2449,17 @@ def list_sudoku_leaderboard(limit: int = 20) -> list[Dict[str, Any]]:
             """,
             (limit,),
         ).fetchall()
-    return [dict(row) for row in rows]
+    return rows
 
 
 def create_chat_message(account_id: int, text: str) -> Dict[str, Any]:
-    timestamp = datetime.now(timezone.utc).isoformat()
+    timestamp = now_iso()
     with get_db_connection() as connection:
         cursor = connection.execute(
             "INSERT INTO chat_messages (account_id, text, created_at) VALUES (?, ?, ?)",
             (account_id, text, timestamp),
         )
         message_id = cursor.lastrowid
-        connection.commit()
 
     return {
         "id": message_id,
@@ -1624,27 +2469,37 @@ def create_chat_message(account_id: int, text: str) -> Dict[str, Any]:
     }
 
 
-def list_chat_messages(limit: int = 50) -> list[Dict[str, Any]]:
+def latest_chat_message_id() -> Optional[int]:
+    with get_db_connection() as connection:
+        row = connection.execute("SELECT MAX(id) FROM chat_messages").fetchone()
+    return row[0]
+
+
+def list_chat_messages(limit: int = CHAT_HISTORY_LIMIT) -> list[sqlite3.Row]:
+    # id 随写入单调递增，按 rowid 倒序取最近的消息无需排序整张表，外层再转成正序
     with get_db_connection() as connection:
         rows = connection.execute(
             """
-            SELECT cm.id, cm.account_id, cm.text, cm.created_at, a.username
-            FROM chat_messages cm
-            JOIN accounts a ON cm.account_id = a.id
-            ORDER BY cm.created_at DESC
-            LIMIT ?
+            SELECT * FROM (
+                SELECT cm.id, cm.account_id, cm.text, cm.created_at, a.username
+                FROM chat_messages cm
+                JOIN accounts a ON cm.account_id = a.id
+                ORDER BY cm.id DESC
+                LIMIT ?
+            )
+            ORDER BY id ASC
             """,
             (limit,),
         ).fetchall()
-    return [dict(row) for row in reversed(rows)]
+    return rows
 
 
 def serialize_chat_message(message: Dict[str, Any]) -> Dict[str, Any]:
     return {
-        "id": message.get("id"),
-        "sender": message.get("username"),
-        "text": message.get("text"),
-        "timestamp": message.get("created_at"),
+        "id": message["id"],
+        "sender": message["username"],
+        "text": message["text"],
+        "timestamp": message["created_at"],
     }
 
 
@@ -0,0 +1,148 @@
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+from backend import app as backend_app
+
+
+class FakeWS:
+    def __init__(self, block: threading.Event | None = None, fail: bool = False) -> None:
+        self.connected = True
+        self.sent: list[str | bytes] = []
+        self.closed = False
+        self._block = block
+        self._fail = fail
+
+    def send(self, payload: str | bytes) -> None:
+        if self._fail:
+            raise ConnectionError("peer gone")
+        if self._block is not None:
+            self._block.wait()
+        self.sent.append(payload)
+
+    def close(self) -> None:
+        self.closed = True
+        self.connected = False
+
+
+class SendToClientsTest(unittest.TestCase):
+    def test_stuck_client_expires_at_deadline(self) -> None:
+        release = threading.Event()
+        self.addCleanup(release.set)
+        stuck = FakeWS(block=release)
+        healthy = FakeWS()
+
+        with mock.patch.object(backend_app, "WS_SEND_TIMEOUT", 0.2):
+            started = time.monotonic()
+            stale = backend_app.send_to_clients([(stuck, "a"), (healthy, "b")])
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(stale, [stuck])
+        self.assertEqual(healthy.sent, ["b"])
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 1.0)
+
+    def test_disconnected_and_failing_clients_are_stale(self) -> None:
+        closed = FakeWS()
+        closed.connected = False
+        failing = FakeWS(fail=True)
+        healthy = FakeWS()
+
+        stale = backend_app.send_to_clients([(closed, "a"), (failing, "b"), (healthy, "c")])
+
+        self.assertCountEqual(stale, [closed, failing])
+        self.assertEqual(closed.sent, [])
+        self.assertEqual(healthy.sent, ["c"])
+
+
+class ChatManagerPruneTest(unittest.TestCase):
+    def test_broadcast_drops_and_closes_stale_clients(self) -> None:
+        manager = backend_app.ChatManager()
+        healthy = FakeWS()
+        failing = FakeWS(fail=True)
+        with manager._lock:
+            manager._clients[healthy] = ("alice", backend_app.WS_FORMAT_JSON)
+            manager._clients[failing] = ("bob", backend_app.WS_FORMAT_JSON)
+            manager._refresh_snapshot_locked()
+
+        with mock.patch.object(manager, "broadcast_user_list", return_value=True):
+            manager.broadcast({"type": "system_message", "payload": {"text": "hi"}})
+
+        self.assertNotIn(failing, manager._clients)
+        self.assertIn(healthy, manager._clients)
+        self.assertTrue(failing.closed)
+        self.assertEqual(len(healthy.sent), 2)
+        self.assertIn("bob", backend_app.loads_json(healthy.sent[-1])["payload"]["text"])
+
+
+class LastSeenBufferTest(unittest.TestCase):
+    def setUp(self) -> None:
+        database_path = Path(tempfile.mkdtemp()) / "test.db"
+        patcher = mock.patch.object(backend_app, "DATABASE_PATH", database_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        backend_app.init_db(database_path)
+
+        self.old = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        with sqlite3.connect(database_path) as connection:
+            connection.execute(
+                "INSERT INTO accounts (id, username, password_hash, phone, created_at) VALUES (1, 'alice', '', '1', ?)",
+                (self.old,),
+            )
+            connection.executemany(
+                "INSERT INTO sessions (token, account_id, created_at, last_seen) VALUES (?, 1, ?, ?)",
+                [("t1", self.old, self.old), ("t2", self.old, self.old)],
+            )
+        self.database_path = database_path
+
+        # 间隔足够长，后台线程不会在测试中自行落库
+        self.buffer = backend_app.LastSeenBuffer(interval=3600)
+        self.addCleanup(self.buffer.shutdown)
+
+    def last_seen(self) -> dict[str, str]:
+        with sqlite3.connect(self.database_path) as connection:
+            return dict(connection.execute("SELECT token, last_seen FROM sessions"))
+
+    def test_flush_writes_latest_touch_once(self) -> None:
+        self.buffer.touch("t1", 1, "2030-01-01T00:00:01+00:00")
+        self.buffer.touch("t1", 1, "2030-01-01T00:00:02+00:00")
+
+        with mock.patch.object(backend_app, "notify_online_users_change") as notify:
+            self.buffer.flush()
+            self.buffer.flush()
+
+        self.assertEqual(notify.call_count, 1)
+        self.assertFalse(self.buffer.contains("t1"))
+        self.assertEqual(
+            self.last_seen(), {"t1": "2030-01-01T00:00:02+00:00", "t2": self.old}
+        )
+
+    def test_latest_by_account_merges_tokens(self) -> None:
+        self.buffer.touch("t1", 1, "2030-01-01T00:00:02+00:00")
+        self.buffer.touch("t2", 1, "2030-01-01T00:00:01+00:00")
+        self.buffer.touch("t3", 2, "2030-01-01T00:00:03+00:00")
+
+        self.assertEqual(
+            self.buffer.latest_by_account(),
+            {1: "2030-01-01T00:00:02+00:00", 2: "2030-01-01T00:00:03+00:00"},
+        )
+
+    def test_online_users_include_unflushed_heartbeats(self) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        self.buffer.touch("t1", 1, now)
+
+        with mock.patch.object(backend_app, "last_seen_buffer", self.buffer):
+            users = backend_app.list_online_users()
+
+        self.assertEqual(users[0]["lastSeen"], now)
+        self.assertTrue(users[0]["online"])
+        self.assertEqual(self.last_seen()["t1"], self.old)
+
+
+if __name__ == "__main__":
+    unittest.main()